@@ -10,11 +10,31 @@ experiment_run.py controls what happens when
 this file controls what gets drawn and for how long
 """
 
+import functools
 import math
 from expyriment import stimuli
 from expyriment.misc import constants, geometry
 
 
+# ============================================================
+# --- FRAME TIMING ---
+# The display only changes on a refresh, so durations are really a
+# number of frames. We assume a 60 Hz monitor.
+# ============================================================
+
+REFRESH_RATE_HZ = 60
+MS_PER_FRAME = 1000.0 / REFRESH_RATE_HZ # ~16.67 ms
+NS_PER_FRAME = round(1_000_000_000 / REFRESH_RATE_HZ) # same, as integer ns
+FLIP_SLACK_MS = 1.0 # wake up a bit before the target refresh
+
+
+def ms_to_frames(duration_ms):
+    """
+    Number of whole frames closest to duration_ms.
+    """
+    return int(round(duration_ms / MS_PER_FRAME))
+
+
 # ============================================================
 # --- BASIC SCREEN CONTROL HELPERS ---
 # ============================================================
@@ -25,12 +45,53 @@ def _blit_to_backbuffer(exp, stim_list):
 
     We don't flip here. This lets us prepare the frame first.
     """
+    # Without OpenGL, a preloaded stimulus is just a pygame surface, so we
+    # blit it ourselves and skip the rest of Expyriment's present().
+    screen_surface = None if exp.screen.opengl else exp.screen.surface
     for stim in stim_list:
-        stim.present(clear=False, update=False)  # draw but don't flip yet
+        if screen_surface is not None and stim.is_preloaded:
+            _blit_preloaded(screen_surface, stim)
+        else:
+            stim.present(False, False)  # (clear, update): draw but don't flip yet
     # We do NOT clear here. Callers are responsible for clearing screen
     # before first blit if needed.
 
 
+def _blit_preloaded(screen_surface, stim):
+    """
+    Blit a preloaded stimulus straight onto the screen surface.
+
+    Same placement as Expyriment's Visual.present() in non-OpenGL mode
+    (centered on stim.position), but without the preload check and the
+    event-file logging.
+    """
+    surface = stim._surface
+    w, h = surface.get_size()
+    x, y = geometry.position_to_coordinates(stim.position,
+                                            screen_surface.get_size())
+    if w % 2 == 0:
+        x += 1
+    if h % 2 == 0:
+        y += 1
+    screen_surface.blit(surface, (x - w // 2, y - h // 2))
+
+
+def preload_stims(stim_list):
+    """
+    Preload stimuli so drawing them later is just a blit.
+
+    Call this outside of timed phases: preloading rasterizes the stimulus,
+    which can take longer than a frame.
+
+    In OpenGL mode a plain preload() also compresses the surface to a temp
+    file on disk, so we pass inhibit_ogl_compress=True and keep it in
+    memory (same as Expyriment's own present() does).
+    """
+    for stim in stim_list:
+        if not stim.is_preloaded:
+            stim.preload(inhibit_ogl_compress=True)
+
+
 def _timed_flip_and_measure(exp):
     """
     Flip the backbuffer to the screen and return the timestamp (in ms).
@@ -79,17 +140,19 @@ def present_for_ms(exp, stim_list, duration_ms):
 
     How it works:
     1. draw + flip (get the flip timestamp)
-    2. busy-wait / sleep until total time on screen reaches duration_ms
+    2. wait until total time on screen reaches duration_ms, rounded to
+       whole frames. We stop FLIP_SLACK_MS early so the caller's next flip
+       lands on the intended refresh instead of one frame late.
     """
     flip_t = _timed_draw(exp, stim_list)
-    target_t = flip_t + duration_ms
+    n_frames = ms_to_frames(duration_ms)
+    target_t = flip_t + n_frames * MS_PER_FRAME - FLIP_SLACK_MS
 
-    # Simple wait loop. We try to sleep in small chunks so timing isn't horrible.
-    while True:
-        now = exp.clock.time
-        remaining = target_t - now
-        if remaining <= 0:
-            break
+    # Expyriment's clock.wait keeps pumping events and spins only at the end,
+    # so it is both accurate and doesn't freeze the window.
+    remaining = target_t - exp.clock.time
+    if remaining > 0:
+        exp.clock.wait(remaining)
 
 
 # ============================================================
@@ -101,28 +164,23 @@ def hsv_to_rgb(h, s, v):
     Convert HSV in [0,1] to RGB in [0,255].
 
     We use this to assign each memory item a color on a color wheel.
+    Each channel is a clamped "tent" over the 6 hue sectors, so we don't
+    need an if/elif per sector.
     """
-    i = int(h * 6.0)
-    f = (h * 6.0) - i
-    p = v * (1.0 - s)
-    q = v * (1.0 - s * f)
-    t = v * (1.0 - s * (1.0 - f))
-    i = i % 6
-
-    if i == 0:
-        r, g, b = v, t, p
-    elif i == 1:
-        r, g, b = q, v, p
-    elif i == 2:
-        r, g, b = p, v, t
-    elif i == 3:
-        r, g, b = p, q, v
-    elif i == 4:
-        r, g, b = t, p, v
-    else:
-        r, g, b = v, p, q
-
-    return [int(r * 255), int(g * 255), int(b * 255)]
+    h6 = (h % 1.0) * 6.0
+    r = max(0.0, min(1.0, abs(h6 - 3.0) - 1.0))
+    g = max(0.0, min(1.0, 2.0 - abs(h6 - 2.0)))
+    b = max(0.0, min(1.0, 2.0 - abs(h6 - 4.0)))
+
+    # scale by chroma and lift by the minimum channel value
+    c = v * s
+    m = v - c
+    return [int((r * c + m) * 255), int((g * c + m) * 255), int((b * c + m) * 255)]
+
+
+# Saturation and value are fixed, so the whole wheel only has 360 integer hues.
+# We convert them once at import and just index into the table afterwards.
+_WHEEL_LUT = tuple(tuple(hsv_to_rgb(d / 360.0, 0.9, 0.9)) for d in range(360))
 
 
 def color_from_wheel(angle_deg):
@@ -131,17 +189,60 @@ def color_from_wheel(angle_deg):
 
     We basically treat angle as hue on the color wheel.
     Saturation and value are high to make colors pop.
+    Hues are looked up in _WHEEL_LUT (1 deg resolution).
     """
-    hue = (angle_deg % 360) / 360.0
-    return hsv_to_rgb(hue, 0.9, 0.9)
+    return _WHEEL_LUT[int(angle_deg) % 360]
 
 
 # ============================================================
 # --- STIMULUS BUILDERS ---
 # These functions return Expyriment stimuli that we can blit.
 # Nothing is presented here. We just *create* them.
+#
+# The same (size, colour, orientation) comes back many times over an
+# experiment, so the rasterized stimuli are cached and only their
+# position is updated. Cached stimuli are shared: callers may move them
+# but must not rotate / modify them.
 # ============================================================
 
+def _make_rect(size, colour, angle_deg=0):
+    """
+    Filled rectangle of a given size/colour, rotated by angle_deg.
+    """
+    rect = stimuli.Rectangle(size=size, colour=colour)
+    if angle_deg:
+        rect.rotate(angle_deg)
+    return rect
+
+
+@functools.lru_cache(maxsize=512)
+def _build_rect(size, colour, angle_deg=0):
+    return _make_rect(size, colour, angle_deg)
+
+
+@functools.lru_cache(maxsize=360)
+def _build_probe_rect(size, colour, angle_deg):
+    return _make_rect(size, colour, angle_deg)
+
+
+def make_fixation_cross(size_px=16, line_width=2, colour=constants.C_BLACK):
+    """
+    Fixation cross at the center of the screen.
+    It never changes, so it is built once and reused every trial.
+    """
+    return _build_fixation_cross(size_px, line_width, tuple(colour))
+
+
+@functools.lru_cache(maxsize=4)
+def _build_fixation_cross(size_px, line_width, colour):
+    return stimuli.FixCross(
+        size=(size_px, size_px),
+        line_width=line_width,
+        colour=colour,
+        position=(0, 0)
+    )
+
+
 def make_oriented_colored_bar(
     angle_deg,
     color_angle_deg,
@@ -160,12 +261,8 @@ def make_oriented_colored_bar(
     # Color is based on color_angle_deg.
     rgb = color_from_wheel(color_angle_deg)
 
-    # Build a rectangle, then rotate it to desired angle.
-    bar = stimuli.Rectangle(
-        size=(length_px, width_px),
-        colour=rgb
-    )
-    bar.rotate(angle_deg)
+    # Rectangle rotated to the desired angle (cached), then moved in place.
+    bar = _build_rect((length_px, width_px), rgb, angle_deg)
     bar.position = center_xy
     return bar
 
@@ -175,16 +272,44 @@ def make_outline_square(center_xy, size_px=80, line_width=3, colour=constants.C_
     Little square frame used around the probed location during response.
     Just a visual hint: "this is the item you're reporting".
     """
-    square = stimuli.Rectangle(
-        size=(size_px, size_px),
+    square = _build_outline((size_px, size_px), tuple(colour), line_width)
+    square.position = center_xy
+    return square
+
+
+@functools.lru_cache(maxsize=16)
+def _build_outline(size, colour, line_width):
+    """
+    Outlined rectangle; only depends on size / colour / line width.
+    """
+    return stimuli.Rectangle(
+        size=size,
         colour=colour,          # border color
         line_width=line_width  # >0 means it's an outlined box, not filled
     )
-    square.position = center_xy
-    return square
 
 
 
+# Attach point tuning (keeps arrow head touching shaft tip).
+# Arrows are diagonal, so the offset is split equally over x and y.
+ARROW_ATTACH_PX = 20
+_ATTACH_DIAG = ARROW_ATTACH_PX / math.sqrt(2)
+
+# Arrow head: same triangle for every arrow (Shape copies the vertices).
+_ARROW_HEAD_VERTS = geometry.vertices_regular_polygon(3, 25)
+
+# index = (tx < 0) << 1 | (ty < 0), see make_spatial_cue_arrows()
+_QUADRANT_DIRS = ('top_right', 'bottom_right', 'top_left', 'bottom_left')
+
+# direction -> (shaft rotation, x sign, y sign, head rotation)
+_ARROW_DIRS = {
+    'top_right':    (45,  +1, +1, 315), # head at -45°
+    'top_left':     (135, -1, +1, 45),
+    'bottom_left':  (225, -1, -1, 135),
+    'bottom_right': (315, +1, -1, 225),
+}
+
+
 def make_spatial_cue_arrows(target_position_px, color=constants.C_BLACK):
     """
     Retro-cue for spatial condition.
@@ -197,14 +322,19 @@ def make_spatial_cue_arrows(target_position_px, color=constants.C_BLACK):
     """
     tx, ty = target_position_px
 
-    if tx >= 0 and ty >= 0:
-        direction = "top_right"
-    elif tx <= 0 and ty >= 0:
-        direction = "top_left"
-    elif tx <= 0 and ty <= 0:
-        direction = "bottom_left"
-    else:
-        direction = "bottom_right"
+    # quadrant as 2 bits: (left?, bottom?); points on an axis count as right/top
+    direction = _QUADRANT_DIRS[((tx < 0) << 1) | (ty < 0)]
+
+    # There are only 4 directions, so the arrows are built once per
+    # (direction, color) and reused.
+    return list(_build_cue_arrows(direction, tuple(color)))
+
+
+@functools.lru_cache(maxsize=16)
+def _build_cue_arrows(direction, color):
+    """
+    Build the two stacked arrows of the spatial cue for one direction.
+    """
 
     def build_single_arrow(direction='top_left', length=100, width=10,
                            color=color, y_offset_px=0):
@@ -222,49 +352,19 @@ def make_spatial_cue_arrows(target_position_px, color=constants.C_BLACK):
 
         # triangle head
         tri = stimuli.Shape(
-            vertex_list=geometry.vertices_regular_polygon(3, 25),
+            vertex_list=_ARROW_HEAD_VERTS,
             colour=color,
             position=(0, y_offset_px)
         )
 
-        # Attach point tuning (keeps arrow head touching shaft tip)
-        ATTACH = 20  # px
-
-        if direction == 'top_right':
-            rect.rotate(45)
-            tri_x =  length / 2
-            tri_y =  y_offset_px + length / 2
-            tri_x -= ATTACH / math.sqrt(2)
-            tri_y -= ATTACH / math.sqrt(2)
-            tri.position = (tri_x, tri_y)
-            tri.rotate(315)  # -45°
-
-        elif direction == 'top_left':
-            rect.rotate(135)
-            tri_x = -length / 2
-            tri_y =  y_offset_px + length / 2
-            tri_x += ATTACH / math.sqrt(2)
-            tri_y -= ATTACH / math.sqrt(2)
-            tri.position = (tri_x, tri_y)
-            tri.rotate(45)
-
-        elif direction == 'bottom_left':
-            rect.rotate(225)
-            tri_x = -length / 2
-            tri_y =  y_offset_px - length / 2
-            tri_x += ATTACH / math.sqrt(2)
-            tri_y += ATTACH / math.sqrt(2)
-            tri.position = (tri_x, tri_y)
-            tri.rotate(135)
-
-        elif direction == 'bottom_right':
-            rect.rotate(315)
-            tri_x =  length / 2
-            tri_y =  y_offset_px - length / 2
-            tri_x -= ATTACH / math.sqrt(2)
-            tri_y += ATTACH / math.sqrt(2)
-            tri.position = (tri_x, tri_y)
-            tri.rotate(225)
+        # head sits at the shaft tip, pulled back along the diagonal
+        rect_rot, sx, sy, tri_rot = _ARROW_DIRS[direction]
+        rect.rotate(rect_rot)
+        tri.position = (
+            sx * (length / 2 - _ATTACH_DIAG),
+            y_offset_px + sy * (length / 2 - _ATTACH_DIAG)
+        )
+        tri.rotate(tri_rot)
 
         return rect, tri
 
@@ -286,16 +386,22 @@ def make_spatial_cue_arrows(target_position_px, color=constants.C_BLACK):
         y_offset_px=+GAP/2.0
     )
 
-    return [arrow1_rect, arrow1_tri, arrow2_rect, arrow2_tri]
+    return (arrow1_rect, arrow1_tri, arrow2_rect, arrow2_tri)
 
 
-def make_color_cue_square(rgb_color, size_px=100):
+def make_color_cue_square(hue_deg, size_px=100):
     """
     Retro-cue for color condition.
 
-    Just a filled colored square at fixation.
+    Just a filled colored square at fixation, in the color of hue_deg on
+    the color wheel (same as the cued bar). Cached per (hue, size).
     """
-    sq = stimuli.Rectangle(size=(size_px, size_px), colour=rgb_color)
+    return _build_color_cue_square(int(hue_deg) % 360, size_px)
+
+
+@functools.lru_cache(maxsize=512)
+def _build_color_cue_square(hue_deg, size_px):
+    sq = stimuli.Rectangle(size=(size_px, size_px), colour=_WHEEL_LUT[hue_deg])
     sq.position = (0, 0)
     return sq
 
@@ -306,12 +412,15 @@ def make_probe_bar(angle_deg, center_xy, length_px=60, width_px=10, color=consta
 
     angle_deg: current rotation we're showing to the participant
     center_xy: position of the probed item
+
+    Pass whole degrees: each angle's rotated bar is cached, with its own
+    cache so the memory bars (many colours) don't push the probe out.
     """
-    bar = stimuli.Rectangle(size=(length_px, width_px), colour=color)
-    bar.rotate(angle_deg)
+    bar = _build_probe_rect((length_px, width_px), tuple(color), angle_deg)
     bar.position = center_xy
     return bar
 
+
 def make_feedback_text(
     text,
     color=constants.C_BLACK,
@@ -320,7 +429,15 @@ def make_feedback_text(
     """
     Feedback after response, e.g. "Error: 12.3°".
     Displayed at fixation.
+
+    Errors are shown with 1 decimal, so the same text comes back often;
+    the rendered line is cached per (text, color, size).
     """
+    return _build_feedback_text(text, tuple(color), font_size)
+
+
+@functools.lru_cache(maxsize=512)
+def _build_feedback_text(text, color, font_size):
     return stimuli.TextLine(
         text=text,
         text_colour=color,
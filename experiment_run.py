@@ -14,20 +14,26 @@ Trial structure:
 8. log trial data
 """
 
+import collections
+import itertools
 import random
-from expyriment import design, control, stimuli
+import time
+import pygame
+from expyriment import design, control
 from expyriment.misc import constants
 
 from drawing_and_timing import (
     present_for_ms,
     draw_now,
+    preload_stims,
+    make_fixation_cross,
     make_oriented_colored_bar,
     make_outline_square,
     make_spatial_cue_arrows,
     make_color_cue_square,
     make_probe_bar,
     make_feedback_text,
-    color_from_wheel, # we use this to turn hue (deg) into an RGB square for the color cue
+    NS_PER_FRAME,
     show_instructions_text
 )
 
@@ -50,7 +56,12 @@ FEEDBACK_DURATION_MS = 1000 # how long we show feedback text
 
 N_ITEMS_PER_ARRAY = 4
 REPEATS_PER_CONDITION = 28 # per (cue_type x delay)
-CUE_TYPES = ["spatial", "color", "no_cue"]
+
+# cue types are small ints (index into CUE_NAMES / the cue builder table);
+# the name is only looked up when a row of data is written
+CUE_SPATIAL, CUE_COLOR, CUE_NONE = 0, 1, 2
+CUE_NAMES = ("spatial", "color", "no_cue")
+CUE_TYPES = (CUE_SPATIAL, CUE_COLOR, CUE_NONE)
 
 
 # ============================================================
@@ -90,13 +101,23 @@ ORI_MIN_SEP_DEG = 30 # bars differ by at least 30° orientation
 COL_RANGE_DEG = (1, 360) # allowed hues on color wheel
 COL_MIN_SEP_DEG = 60 # hues differ by at least 60° on the wheel
 
+SAMPLE_BATCH_SIZE = 64 # candidates drawn per RNG call when sampling the above
+
+# all of our randomness goes through this one generator (seeded per
+# subject), so nothing else using the global `random` can shift it
+_RNG = random.Random()
+
+
+def _set_seed(seed):
+    _RNG.seed(seed)
+
 
 # ============================================================
 # --- COUNTER-BALLANCING ---
 # We generate all trials here.
 # ============================================================
 
-def build_trial_list():
+def build_trial_list(subject_id=None):
     """
     We want:
     For each (cue_type, delay) pair : total REPEATS_PER_CONDITION trials (e.g. 28)
@@ -105,26 +126,37 @@ def build_trial_list():
 
     With defaults:
     3 cue types x 5 delays x 28 = 420 trials total.
+
+    The full (cue_type x delay x location) grid is built in one go and
+    shuffled once at the end. Each trial's memory array (orientations and
+    colors) is sampled here too, so none of that happens between trials.
+
+    Returns a list of tuples, in run_single_trial() argument order:
+        (cue_type, delay, target_loc_idx, orientations, colors)
+
+    The RNG is seeded with subject_id, so the same subject always gets the
+    same schedule and arrays (replays / cross-run comparisons).
+    subject_id=None keeps it random.
     """
-    trials = []
+    _set_seed(subject_id)
     reps_per_loc = REPEATS_PER_CONDITION // 4
 
-    for cue_type in CUE_TYPES: # 3
-        for dly in CUE_PROBE_DELAYS_MS: # 5
-            # build the 28 trials for this (cue_type, dly)
-            block_trials = []
-            for loc_idx in range(N_ITEMS_PER_ARRAY): # 0..3
-                for _ in range(reps_per_loc): # 7
-                    block_trials.append({
-                        "cue_type": cue_type,
-                        "delay": dly,
-                        "target_loc_idx": loc_idx,
-                    })
-            random.shuffle(block_trials)
-            trials.extend(block_trials)
+    conditions = itertools.product(
+        CUE_TYPES, # 3
+        CUE_PROBE_DELAYS_MS, # 5
+        range(N_ITEMS_PER_ARRAY), # 0..3
+    )
+    schedule = [
+        condition
+        for condition in conditions
+        for _ in range(reps_per_loc) # 7
+    ]
+    _RNG.shuffle(schedule)
 
-    random.shuffle(trials)
-    return trials
+    return [
+        (cue_type, dly, loc_idx) + create_memory_array()
+        for cue_type, dly, loc_idx in schedule
+    ]
 
 
 # ============================================================
@@ -135,37 +167,43 @@ def circular_distance(a, b, period):
     """
     Smallest distance between angles a and b on a circular scale (used for hue)
     """
-    diff = abs(a - b) % period
-    return min(diff, period - diff)
+    half = period * 0.5
+    return half - abs((a - b) % period - half)
 
 
-def sample_orientations(n, min_sep, lo, hi):
+def axial_abs_diff(a, b):
     """
-    Sample n orientations (integers in [lo, hi]) such that all chosen values
-    are at least min_sep apart.
-
-    We retry until we get n that respect spacing.
+    Smallest distance between orientations a and b for an axial (mod 180)
+    quantity like a bar's orientation, folded into [0, 90].
     """
-    chosen = []
-    while len(chosen) < n:
-        cand = random.randint(lo, hi)
-        if all(abs(cand - prev) >= min_sep for prev in chosen):
-            chosen.append(cand)
-    return chosen
+    raw = (a - b) % 180.0
+    return 90.0 - abs(raw - 90.0)
 
 
-def sample_colors(n, min_sep, lo, hi):
+def sample_circular(n, min_sep, lo, hi, period):
     """
-    Sample n hues (integers in [lo, hi]) on a 0-360° color wheel,
-    such that circular distance between any two is >= min_sep.
+    Sample n values (integers in [lo, hi]) on a circular scale of the given
+    period, such that circular distance between any two is >= min_sep.
+
+    Used for both orientations (period 180: bars are axial, so 5° and 175°
+    are only 10° apart) and hues (period 360, color wheel).
 
-    These hue values later get converted into RGB with color_from_wheel().
+    We retry until we get n that respect spacing. Candidates are drawn in
+    batches and walked greedily; a new batch is only drawn if one wasn't
+    enough (rare).
     """
+    values = range(lo, hi + 1)
     chosen = []
     while len(chosen) < n:
-        cand = random.randint(lo, hi)
-        if all(circular_distance(cand, prev, 360) >= min_sep for prev in chosen):
-            chosen.append(cand)
+        for cand in _RNG.choices(values, k=SAMPLE_BATCH_SIZE):
+            # plain loop: stops at the first clash, no generator per candidate
+            for prev in chosen:
+                if circular_distance(cand, prev, period) < min_sep:
+                    break
+            else:
+                chosen.append(cand)
+                if len(chosen) == n:
+                    break
     return chosen
 
 
@@ -173,35 +211,28 @@ def create_memory_array():
     """
     Build ONE memory array for a trial.
 
-    Returns a list of 4 dicts, one per item:
-    {
-        "pos":        (x,y),         # where it goes on screen
-        "ori_deg":    θ,             # the true orientation we want them to remember
-        "color_deg":  hue_degrees    # used to derive the item's color
-    }
+    Returns two parallel lists (one entry per item, item i is shown at
+    ITEM_POSITIONS_PX[i]):
+        orientations  # the true orientations we want them to remember (deg)
+        colors        # hue degrees, used to derive each item's color
     """
-    orientations = sample_orientations(
+    orientations = sample_circular(
         n=N_ITEMS_PER_ARRAY,
         min_sep=ORI_MIN_SEP_DEG,
         lo=ORI_RANGE_DEG[0],
-        hi=ORI_RANGE_DEG[1]
+        hi=ORI_RANGE_DEG[1],
+        period=180
     )
 
-    colors = sample_colors(
+    colors = sample_circular(
         n=N_ITEMS_PER_ARRAY,
         min_sep=COL_MIN_SEP_DEG,
         lo=COL_RANGE_DEG[0],
-        hi=COL_RANGE_DEG[1]
+        hi=COL_RANGE_DEG[1],
+        period=360
     )
 
-    bars = []
-    for i in range(N_ITEMS_PER_ARRAY):
-        bars.append({
-            "pos": ITEM_POSITIONS_PX[i],
-            "ori_deg": orientations[i],
-            "color_deg": colors[i],
-        })
-    return bars
+    return orientations, colors
 
 
 # ============================================================
@@ -209,52 +240,104 @@ def create_memory_array():
 # This is the core of the task. We run this many times within each block.
 # ============================================================
 
-def run_single_trial(exp, cue_type, cue_probe_delay_ms, target_loc_idx):
+# One row of trial data, in the same order as exp.data_variable_names.
+TrialResult = collections.namedtuple(
+    "TrialResult",
+    "cue_type delay target_loc_idx true_orientation reported_orientation offset"
+)
+
+
+# The cue tells the subject which item from the array matters.
+#
+# spatial cue  = arrows from fixation pointing toward the item's location
+# color cue    = solid square at fixation with that item's color
+# no cue       = nothing (just a blank of the same duration)
+#
+# Each helper takes (target_pos_px, target_color_deg) and returns the list
+# of stimuli to show; _CUE_STIMS is indexed by cue type.
+
+def _spatial_cue_stims(target_pos_px, target_color_deg):
+    return make_spatial_cue_arrows(
+        target_position_px=target_pos_px,
+        color=constants.C_BLACK
+    )
+
+
+def _color_cue_stims(target_pos_px, target_color_deg):
+    color_cue = make_color_cue_square(
+        hue_deg=target_color_deg,
+        size_px=100
+    )
+    return [color_cue]
+
+
+def _no_cue_stims(target_pos_px, target_color_deg):
+    return []
+
+
+_CUE_STIMS = (_spatial_cue_stims, _color_cue_stims, _no_cue_stims)
+
+
+def run_single_trial(exp, cue_type, cue_probe_delay_ms, target_loc_idx,
+                     orientations, colors):
     """
     Run ONE full trial with a given cue type and a given cue/probe delay.
 
-    cue_type: "spatial", "color", or "no_cue"
+    cue_type: CUE_SPATIAL, CUE_COLOR, or CUE_NONE
     cue_probe_delay_ms: how long we wait between the cue disappearing and the probe/response appearing
-
-    Returns a dict with response data:
-        {
-            "cue_type": str,
-            "delay": int,
-            "true_orientation": float,
-            "reported_orientation": float,
-            "offset": float   # absolute error in deg (0-180°)
-        }
+    orientations, colors: this trial's memory array (see create_memory_array())
+
+    Returns a TrialResult with response data:
+        cue_type: str   # CUE_NAMES[cue_type]
+        delay: int
+        target_loc_idx: int
+        true_orientation: float
+        reported_orientation: float
+        offset: float   # absolute error in deg (0-90°)
     """
 
     exp.mouse.show_cursor() # participant uses mouse to rotate the probe bar
 
     # --------------------------------------------------------
-    # 1. Fixation cross
+    # 0. Build this trial's stimuli up front
+    # Everything shown before the response phase is known already, so we
+    # build and preload it here (inter-trial interval) instead of
+    # rasterizing inside the timed phases.
     # --------------------------------------------------------
-    fixation = stimuli.FixCross(
-        size=(16, 16),
+    fixation = make_fixation_cross(
+        size_px=16,
         line_width=2,
-        colour=constants.C_BLACK,
-        position=(0, 0)
+        colour=constants.C_BLACK
     )
-    present_for_ms(exp, [fixation], FIXATION_DURATION_MS)
-
-    # --------------------------------------------------------
-    # 2. Memory array (4 bars: position, orientation, color)
-    # --------------------------------------------------------
-    bars = create_memory_array()
 
     bar_stims = []
-    for bar in bars:
+    for pos, ori_deg, color_deg in zip(ITEM_POSITIONS_PX, orientations, colors):
         stim = make_oriented_colored_bar(
-            angle_deg=bar["ori_deg"],
-            color_angle_deg=bar["color_deg"],
-            center_xy=bar["pos"],
+            angle_deg=ori_deg,
+            color_angle_deg=color_deg,
+            center_xy=pos,
             length_px=BAR_LENGTH_PX,
             width_px=BAR_WIDTH_PX,
         )
         bar_stims.append(stim)
 
+    # the cue for this trial (see _CUE_STIMS above)
+    target_pos_px    = ITEM_POSITIONS_PX[target_loc_idx]
+    target_color_deg = colors[target_loc_idx]
+    target_true_ori  = orientations[target_loc_idx]
+
+    cue_stims = _CUE_STIMS[cue_type](target_pos_px, target_color_deg)
+
+    preload_stims([fixation] + bar_stims + cue_stims)
+
+    # --------------------------------------------------------
+    # 1. Fixation cross
+    # --------------------------------------------------------
+    present_for_ms(exp, [fixation], FIXATION_DURATION_MS)
+
+    # --------------------------------------------------------
+    # 2. Memory array (4 bars: position, orientation, color)
+    # --------------------------------------------------------
     present_for_ms(exp, bar_stims, MEMORY_DURATION_MS)
 
     # --------------------------------------------------------
@@ -263,35 +346,9 @@ def run_single_trial(exp, cue_type, cue_probe_delay_ms, target_loc_idx):
     present_for_ms(exp, [], FIRST_BLANK_DELAY_MS)
 
     # --------------------------------------------------------
-    # 4. Retro-cue
-    # The cue tells the subject which item from the array matters.
-    #
-    # spatial cue  = arrows from fixation pointing toward the item's location
-    # color cue    = solid square at fixation with that item's color
-    # no cue       = nothing (just a blank of the same duration)
+    # 4. Retro-cue (built in step 0; empty list for no cue)
     # --------------------------------------------------------
-    target_bar = bars[target_loc_idx]
-    target_pos_px    = target_bar["pos"]
-    target_color_deg = target_bar["color_deg"]
-    target_true_ori  = target_bar["ori_deg"]
-
-    if cue_type == "spatial":
-        cue_stims = make_spatial_cue_arrows(
-            target_position_px=target_pos_px,
-            color=constants.C_BLACK
-        )
-        present_for_ms(exp, cue_stims, CUE_DURATION_MS)
-
-    elif cue_type == "color":
-        rgb_for_cue = color_from_wheel(target_color_deg)
-        color_cue = make_color_cue_square(
-            rgb_color=rgb_for_cue,
-            size_px=100
-        )
-        present_for_ms(exp, [color_cue], CUE_DURATION_MS)
-
-    elif cue_type == "no_cue":
-        present_for_ms(exp, [], CUE_DURATION_MS)
+    present_for_ms(exp, cue_stims, CUE_DURATION_MS)
 
     # --------------------------------------------------------
     # 5. Variable cue/probe delay (blank screen)
@@ -308,47 +365,88 @@ def run_single_trial(exp, cue_type, cue_probe_delay_ms, target_loc_idx):
     # Subject rotates the probe bar with left/right mouse movement,
     # and confirms with mouse click.
     #
-    # We keep redrawing until they confirm.
+    # We keep redrawing until they confirm, at most once per display
+    # frame and only when the probe actually moved.
     # --------------------------------------------------------
     current_angle = 90.0 # starting orientation of the probe bar (in deg)
     reported_orientation = None
 
     response_done = False
-    last_mouse_x, _ = exp.mouse.position
 
-    while not response_done:
-        # outline marks which location is being tested
-        outline_stim = make_outline_square(
-            center_xy=target_pos_px,
-            size_px=PROBE_MARKER_SIZE_PX,
-            line_width=2,
-            colour=constants.C_BLACK
-        )
+    # outline marks which location is being tested (same for the whole phase)
+    outline_stim = make_outline_square(
+        center_xy=target_pos_px,
+        size_px=PROBE_MARKER_SIZE_PX,
+        line_width=2,
+        colour=constants.C_BLACK
+    )
+    # preloaded so present() doesn't re-rasterize it on every redraw
+    preload_stims([outline_stim])
 
-        # probe bar is what they rotate to report orientation
-        probe_bar_stim = make_probe_bar(
-            angle_deg=current_angle,
-            center_xy=(0, 0),
-            length_px=BAR_LENGTH_PX,
-            width_px=BAR_WIDTH_PX,
-            color=constants.C_BLACK
-        )
+    drawn_angle = None # angle currently on screen (None = nothing drawn yet)
+
+    # Grab the mouse and hide the cursor so SDL hands us relative motion
+    # that isn't clipped at the screen edge; get_rel() once to zero it.
+    # Button events stay tracked (hide_cursor blocks them by default),
+    # otherwise wait_press() below could never see the confirming click.
+    exp.mouse.hide_cursor(track_button_events=True)
+    pygame.event.set_grab(True)
+    pygame.mouse.get_rel()
 
-        draw_now(exp, [outline_stim, probe_bar_stim])
+    # frame deadlines are kept in integer ns (perf_counter_ns) so they
+    # don't pick up the 1 ms rounding of exp.clock.time or float drift
+    next_frame_ns = time.perf_counter_ns()
+
+    while not response_done:
+        # the probe is drawn at whole degrees, so its rotated surface is
+        # cached (360 slots) and small mouse moves don't force a redraw
+        shown_angle = round(current_angle) % 360
+        if shown_angle != drawn_angle:
+            # probe bar is what they rotate to report orientation
+            probe_bar_stim = make_probe_bar(
+                angle_deg=shown_angle,
+                center_xy=(0, 0),
+                length_px=BAR_LENGTH_PX,
+                width_px=BAR_WIDTH_PX,
+                color=constants.C_BLACK
+            )
+            preload_stims([probe_bar_stim])
+
+            draw_now(exp, [outline_stim, probe_bar_stim])
+            drawn_angle = shown_angle
 
         # update orientation based on horizontal mouse movement
-        mouse_x, _ = exp.mouse.position
-        dx = mouse_x - last_mouse_x
+        # (all motion since the last frame, in one call)
+        dx, _ = pygame.mouse.get_rel()
+        # (left unwrapped here; it's wrapped to [0, 360) once on confirm)
         if dx != 0:
-            current_angle = (current_angle + ROTATION_SENSITIVITY * dx) % 360
-            last_mouse_x = mouse_x
+            current_angle += ROTATION_SENSITIVITY * dx
 
         # check confirm (mouse left click OR spacebar)
         mouse_left = exp.mouse.check_button_pressed(0)
+        if not mouse_left:
+            # Wait for the next frame instead of spinning the CPU, but wake
+            # up as soon as a left click comes in. low_performance makes
+            # Expyriment sleep between checks.
+            next_frame_ns += NS_PER_FRAME
+            remaining_ns = next_frame_ns - time.perf_counter_ns()
+            if remaining_ns > 0:
+                btn_id, _, _ = exp.mouse.wait_press(
+                    buttons=0,
+                    duration=remaining_ns / 1_000_000, # wait_press takes ms
+                    low_performance=True
+                )
+                mouse_left = btn_id == 0
+            else:
+                next_frame_ns -= remaining_ns # fell behind: restart schedule from now
+
         if mouse_left:
-            reported_orientation = current_angle
+            reported_orientation = current_angle % 360
             response_done = True
 
+    pygame.event.set_grab(False)
+    exp.mouse.show_cursor()
+
     # --------------------------------------------------------
     # 7. Compute error
     #
@@ -358,10 +456,6 @@ def run_single_trial(exp, cue_type, cue_probe_delay_ms, target_loc_idx):
     #
     # offset = absolute error (deg) between their report and truth
     # --------------------------------------------------------
-    def axial_abs_diff(a, b):
-        raw = abs(a - b) % 180
-        return min(raw, 180 - raw)
-
     offset = axial_abs_diff(reported_orientation, target_true_ori)
 
     # --------------------------------------------------------
@@ -373,19 +467,21 @@ def run_single_trial(exp, cue_type, cue_probe_delay_ms, target_loc_idx):
         color=constants.C_BLACK,
         font_size=24
     )
+    # keep it preloaded: present() on its own would drop the cached surface
+    preload_stims([feedback_msg])
     present_for_ms(exp, [feedback_msg], FEEDBACK_DURATION_MS)
 
     # --------------------------------------------------------
     # 9. Return trial data for logging
     # --------------------------------------------------------
-    return {
-        "cue_type": cue_type,
-        "delay": cue_probe_delay_ms,
-        "target_loc_idx": int(target_loc_idx),
-        "true_orientation": float(target_true_ori),
-        "reported_orientation": float(reported_orientation),
-        "offset": float(offset),
-    }
+    return TrialResult(
+        cue_type=CUE_NAMES[cue_type],
+        delay=cue_probe_delay_ms,
+        target_loc_idx=int(target_loc_idx),
+        true_orientation=float(target_true_ori),
+        reported_orientation=float(reported_orientation),
+        offset=float(offset),
+    )
 
 # ============================================================
 # --- MAIN EXPERIMENT ENTRY POINT ---
@@ -393,6 +489,8 @@ def run_single_trial(exp, cue_type, cue_probe_delay_ms, target_loc_idx):
 # ============================================================
 
 def main():
+    subject_id = 1
+
     # neutral gray background, black text/stim lines
     BG_GRAY = (128, 128, 128)
 
@@ -417,33 +515,38 @@ def main():
         "offset_abs_error_deg"
     ]
 
-    # build randomized trial list
-    all_trials = build_trial_list()
+    # build randomized trial list (reproducible per subject)
+    all_trials = build_trial_list(subject_id)
+
+    # There are only 4 possible spatial cues (one per location): build and
+    # preload them all now so no spatial-cue trial has to. Color cues are
+    # cached as they come up.
+    for pos in ITEM_POSITIONS_PX:
+        preload_stims(make_spatial_cue_arrows(
+            target_position_px=pos,
+            color=constants.C_BLACK
+        ))
 
     # optional: practice trials before we start recording data
+    # (trial tuples are already in run_single_trial() argument order)
     #for _ in range(5): # replace with number of practice trials
-    #     t = random.choice(all_trials)
-    #     run_single_trial(exp, t["cue_type"], t["delay"])
+    #     t = _RNG.choice(all_trials)
+    #     run_single_trial(exp, *t)
 
-    control.start(subject_id=1)
+    control.start(subject_id=subject_id)
 
     show_instructions_text(exp)
 
-    for t in all_trials:
+    for cue_type, dly, target_loc_idx, orientations, colors in all_trials:
         result = run_single_trial(
             exp,
-            cue_type=t["cue_type"],
-            cue_probe_delay_ms=t["delay"],
-            target_loc_idx=t["target_loc_idx"]
+            cue_type=cue_type,
+            cue_probe_delay_ms=dly,
+            target_loc_idx=target_loc_idx,
+            orientations=orientations,
+            colors=colors
         )
-        exp.data.add([
-            result["cue_type"],
-            result["delay"],
-            result["target_loc_idx"],
-            result["true_orientation"],
-            result["reported_orientation"],
-            result["offset"]
-        ])
+        exp.data.add(list(result))
 
     control.end()
 